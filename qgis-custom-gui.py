@@ -9,19 +9,39 @@ __author__ = 'Indraprasta Risaldi'
 __copyright__ = 'Copyright (C) 2023 Indraprasta Risaldi'
 
 __license__ = 'GNU General Public License v2.0'
-__version__ = '1.0.1'
+__version__ = '2.0.0'
 __maintainer__ = 'Indraprasta Risaldi'
 
-from qgis.PyQt.QtCore import QDate, Qt
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+from qgis.core import (QgsField,
+                       QgsFields,
+                       QgsProject,
+                       QgsRasterLayer,
+                       QgsVectorLayer)
+from qgis.gui import (QgsCheckableComboBox,
+                      QgsFieldComboBox,
+                      QgsMapLayerComboBox)
+from qgis.PyQt.QtCore import QDate, Qt, QTimer, QVariant
 from qgis.PyQt.QtGui import QKeyEvent
 from qgis.PyQt.QtWidgets import (QComboBox,
                                  QDialog,
                                  QDialogButtonBox,
                                  QLabel,
+                                 QLineEdit,
                                  QMessageBox,
                                  QPushButton,
                                  QVBoxLayout)
 
+# Shared empty field model, set whenever no layer is selected.
+_EMPTY_FIELDS = QgsFields()
+
+# Supported field types, mapped to the variant type of the field model.
+_QVAR_MAP = {2: QVariant.Int, 4: QVariant.Int, 6: QVariant.Double, 10: QVariant.String, 14: QVariant.Date}
+
 class LayerFieldFeatureWidget(QDialog):
     """
     Map QGIS project instances.
@@ -34,7 +54,8 @@ class LayerFieldFeatureWidget(QDialog):
     filtration can also be conducted based on layer type or geometry type. Assigning
     geometry type and layer type filter together does not stack the effect.
     A filtration of features can then be applied by selecting the values of its
-    attribute in the checkable box.
+    attribute in the checkable box. The dialog window is not shown on construction,
+    call `exec()` on the created instance to show it.
 
     Parameters
     ----------
@@ -44,11 +65,13 @@ class LayerFieldFeatureWidget(QDialog):
     field_matches : iterable(str), optional
         An iterable object that contains strings of field names.
         Make sure to assign those in keys/index in case dictionary is used.
+        All fields are listed if omitted, none if the iterable is empty.
     title : str, optional
         This will be used as dialog title.
     layer_type : str, optional
         A substring of [QgsMapLayerType](https://qgis.org/pyqgis/3.28/core/QgsMapLayerType.html).
         Drop the "Layer" part, case insensitive. Use this for filtering layers based on its type.
+        Only "Vector" and "Raster" are supported, other values raise a ValueError.
     geometry_type : int, optional
         An integer identifier of [QgsWkbTypes.Type](https://qgis.org/pyqgis/3.28/core/QgsWkbTypes.html#qgis.core.QgsWkbTypes.Type)
         Use this for filtering layers based on its geometry type.
@@ -58,27 +81,51 @@ class LayerFieldFeatureWidget(QDialog):
     >>> layer_dict = {'a': None, 'b': None, 'c': None}
     >>> field_list = ['a', 'b', 'c']
     >>> dlg_name_filter = LayerFieldFeatureWidget(layer_dict, field_list, title="My Dictionary Matches")
+    >>> dlg_name_filter.exec()
     >>> dlg_type_filter = LayerFieldFeatureWidget(layer_type='Vector')
+    >>> dlg_type_filter.exec()
     >>> dlg_geom_type_filter = LayerFieldFeatureWidget(geometry_type=1)
+    >>> dlg_geom_type_filter.exec()
     
     Methods
     -------
     accepted_field(self) -> [QgsField](https://qgis.org/pyqgis/3.28/core/QgsField.html#qgis.core.QgsField)
     accepted_layer(self) -> [QgsMapLayerType](https://qgis.org/pyqgis/3.28/core/QgsMapLayerType.html#qgis.core.QgsMapLayerType) 
     """
-    def __init__(self, layer_matches = set(), field_matches = None, title = None, layer_type = set(), geometry_type = set()):
+    # Layer models shared by all dialogs, cleared whenever project layers are added, removed or renamed.
+    _model_cache = {}
+    _model_cache_connected = False
+
+    # Maximum number of features listed at once in the checkable combo box.
+    feature_limit = 500
+
+    # Layer classes supported by the `layer_type` filter.
+    layer_classes = {'vector': QgsVectorLayer, 'raster': QgsRasterLayer}
+
+    def __init__(self, layer_matches = None, field_matches = None, title = None, layer_type = None, geometry_type = None):
         super().__init__()
 
         # Class attributes.
         self.layer_option = "---- Please select a layer ----"
-        self.layer_matches = layer_matches
-        self.field_matches = field_matches
+        self.layer_matches = frozenset(key.lower() for key in layer_matches) if layer_matches else frozenset()
+        self.field_matches = frozenset(key.lower() for key in field_matches) if field_matches is not None else None
         self.title = title
-        self.layer_type = layer_type
-        self.geometry_type = geometry_type
+        if layer_type is not None and not isinstance(layer_type, str):
+            raise TypeError(f"layer_type must be a str, not {type(layer_type).__name__}.")
+        self.layer_type = layer_type.lower() if layer_type is not None else None
+        self.geometry_type = int(geometry_type) if geometry_type else None
+
+        # Validated here, as the layer model is only generated once the dialog window is shown.
+        if self.layer_type and self.layer_type not in self.layer_classes:
+            raise ValueError(f"Unsupported layer type '{layer_type}', expected one of {sorted(self.layer_classes)}.")
+
+        # Layer name matches, tested against every layer name.
+        self.layer_needles = list(self.layer_matches)
+        self.layer_automaton = self.build_layer_automaton(self.layer_needles)
 
-        # Generating inverted model.
-        self.inverted_layer_model = [inverted_layer for inverted_layer in self.generate_layer_model()]
+        # Inverted model is generated once the dialog window is shown, see `populate_layers`.
+        self.connect_model_cache()
+        self.inverted_layer_model = []
 
         # Setting up dialog window.
         if self.title is not None:
@@ -87,10 +134,10 @@ class LayerFieldFeatureWidget(QDialog):
 
         # Create combo box widget, where layer(s) will be displayed.
         self.layer_wdgt = QgsMapLayerComboBox()
-        self.layer_wdgt.setAllowEmptyLayer(True, self.layer_option)
+        self.layer_wdgt.setAllowEmptyLayer(True, "Loading...")
         self.layer_wdgt.setCurrentIndex(0)
         self.layer_wdgt.setShowCrs(True)
-        self.layer_wdgt.setExceptedLayerList(self.inverted_layer_model)
+        self.layer_wdgt.setDisabled(True)
 
         # Create field combo box, where the field(s) of the selected layer will be displayed.
         self.field_wdgt = QgsFieldComboBox()
@@ -98,6 +145,12 @@ class LayerFieldFeatureWidget(QDialog):
 
         # Create feature list checkable combo box, where feature(s) of the selected field will be displayed.
         self.feature_wdgt = QgsCheckableComboBox()
+        self.all_features = []
+
+        # Create filter line edit, shown only if there are more features than `feature_limit`.
+        self.filter_wdgt = QLineEdit()
+        self.filter_wdgt.setVisible(False)
+        self.filter_wdgt.textChanged.connect(self.on_filter_features)
 
         # Connecting signal emitted by `layer_wdgt` to the function `on_selected_layer`.
         self.layer_wdgt.layerChanged.connect(self.on_selected_layer)
@@ -117,8 +170,7 @@ class LayerFieldFeatureWidget(QDialog):
         self.selection_button.accepted.connect(self.on_select_all)
 
         # Connecting reject signal to a function, which cleans all the elements in widgets.
-        self.confirm_button.rejected.connect(self.reject)
-        self.confirm_button.rejected.connect(self.on_reset_layer)
+        self.confirm_button.rejected.connect(self.on_reject)
         self.selection_button.rejected.connect(self.on_deselect_all)
 
         # Create layout, which integrates all defined widgets into the dialog window.
@@ -129,22 +181,27 @@ class LayerFieldFeatureWidget(QDialog):
         self.layout.addWidget(self.field_wdgt)
         self.layout.addWidget(QLabel("Objektauswahl: [optional]"))
         self.layout.addWidget(self.feature_wdgt)
+        self.layout.addWidget(self.filter_wdgt)
         self.layout.addWidget(self.selection_button)
         self.layout.addWidget(self.confirm_button)
         self.setLayout(self.layout)
 
-        # Execute and show dialog window.
-        self.exec()
+        # Generate layer model after the dialog window has been shown.
+        QTimer.singleShot(0, self.populate_layers)
 
     # Below are GUI signal processor functions.
     def keyPressEvent(self, event):
         """Respond to `Esc` and `Return` keys."""
-        if event.type() == QEvent.KeyPress:
-            if event.key() == Qt.Key_Escape:
-                self.reject()
-                self.on_reset_layer()
-            elif event.key() == Qt.Key_Return:
-                self.accept()
+        key = event.key()
+        if key == Qt.Key_Escape:
+            self.on_reject()
+        elif key in (Qt.Key_Return, Qt.Key_Enter) and self.filter_wdgt.hasFocus():
+            # Confirming the feature filter must neither accept the dialog nor press a default button.
+            event.accept()
+        elif key in (Qt.Key_Return, Qt.Key_Enter) and self.ok_button.isEnabled():
+            self.accept()
+        else:
+            super().keyPressEvent(event)
 
     def on_deselect_all(self):
         """Handle `No to all` button signal."""
@@ -154,46 +211,137 @@ class LayerFieldFeatureWidget(QDialog):
         """Handle `Yes to all` button signal."""
         self.feature_wdgt.selectAllOptions()
 
+    def on_filter_features(self, text):
+        """Handle `filter_wdgt` signal."""
+        text = text.lower()
+        self.populate_features([value for value in self.all_features if text in value.lower()])
+
     def on_selected_field(self):
         """Handle `field_wdgt` signal."""
-        self.feature_wdgt.clear()
-        try:
-            attribute_values = self.generate_feature_model()
-            self.feature_wdgt.addItems(attribute_values)
-            self.selection_button.setDisabled(False)
-        except:
-            self.selection_button.setDisabled(True)
-            self.feature_wdgt.clear()
+        self.clear_features()
+        if self.accepted_field() is None:
+            return
+
+        # Fields without any non-NULL value leave the list empty and the buttons disabled.
+        attribute_values = self.generate_feature_model()
+        if not attribute_values:
+            return
+
+        capped = len(attribute_values) > self.feature_limit
+        self.all_features = attribute_values
+        self.show_feature_filter(capped)
+        self.populate_features(attribute_values)
+        self.selection_button.setDisabled(False)
+        # `Yes to all` would only check the listed values, if not all values are listed.
+        self.selection_button.button(QDialogButtonBox.YesToAll).setDisabled(capped)
 
     def on_selected_layer(self):
         """Handle `layer_wdgt` signal."""
-        if self.layer_wdgt.currentIndex() != 0:
-            self.ok_button.setDisabled(False)
-            self.field_wdgt.setFields(self.generate_field_model(self.layer_wdgt.currentLayer()))
-            self.feature_wdgt.clear()
-            if self.feature_wdgt.count() == 0:
-                self.selection_button.setDisabled(True)
-        else:
-            self.ok_button.setDisabled(True)
-            self.selection_button.setDisabled(True)
-            self.field_wdgt.setFields(QgsFields())
-            self.feature_wdgt.clear()
+        # Field signals are blocked, since features are cleared right after anyway.
+        self.field_wdgt.blockSignals(True)
+        try:
+            if self.layer_wdgt.currentIndex() != 0:
+                self.ok_button.setDisabled(False)
+                self.field_wdgt.setFields(self.generate_field_model(self.layer_wdgt.currentLayer()))
+            else:
+                self.ok_button.setDisabled(True)
+                self.field_wdgt.setFields(_EMPTY_FIELDS)
+        finally:
+            self.field_wdgt.blockSignals(False)
+        self.clear_features()
+
+    def populate_layers(self):
+        """Generate inverted model and apply it to `layer_wdgt`."""
+        self.inverted_layer_model = list(self.generate_layer_model())
+        self.layer_wdgt.setExceptedLayerList(self.inverted_layer_model)
+        self.layer_wdgt.setAllowEmptyLayer(True, self.layer_option)
+        self.layer_wdgt.setCurrentIndex(0)
+        self.layer_wdgt.setDisabled(False)
+
+    def on_reject(self):
+        """Handle `Cancel` button signal."""
+        self.reject()
+        self.on_reset_layer()
 
     def on_reset_layer(self):
         """Reset combo box fields."""
-        self.layer_wdgt.setCurrentIndex(0)
-        self.field_wdgt.setCurrentIndex(0)
+        # Signals are blocked to avoid regenerating field and feature models on reset.
+        for wdgt in (self.layer_wdgt, self.field_wdgt):
+            wdgt.blockSignals(True)
+        try:
+            self.layer_wdgt.setCurrentIndex(0)
+            self.field_wdgt.setFields(_EMPTY_FIELDS)
+            self.field_wdgt.setCurrentIndex(0)
+        finally:
+            for wdgt in (self.layer_wdgt, self.field_wdgt):
+                wdgt.blockSignals(False)
+        self.ok_button.setDisabled(True)
+        self.clear_features()
 
     # Below are private functions responding to user entries.
+    def clear_features(self):
+        """Clear `feature_wdgt` and its filter."""
+        self.selection_button.setDisabled(True)
+        self.all_features = []
+        self.show_feature_filter(False)
+        self.feature_wdgt.clear()
+
+    def populate_features(self, values):
+        """
+        Fill `feature_wdgt` with at most `feature_limit` values.
+
+        Checked values not among those are kept on top, so that filtering does
+        not drop the selection.
+        """
+        checked = self.feature_wdgt.checkedItems()
+        values = values[:self.feature_limit]
+        listed = set(values)
+        checked_unlisted = [value for value in checked if value not in listed]
+
+        self.feature_wdgt.blockSignals(True)
+        self.feature_wdgt.setUpdatesEnabled(False)
+        try:
+            self.feature_wdgt.clear()
+            self.feature_wdgt.addItems(checked_unlisted + values)
+            self.feature_wdgt.setCheckedItems(checked)
+        finally:
+            self.feature_wdgt.setUpdatesEnabled(True)
+            self.feature_wdgt.blockSignals(False)
+
+        if len(self.all_features) > self.feature_limit:
+            self.filter_wdgt.setPlaceholderText(f"{len(self.all_features)} Objekte, filtern...")
+
+    def show_feature_filter(self, visible):
+        """Show or hide `filter_wdgt` and resize dialog window accordingly."""
+        self.filter_wdgt.blockSignals(True)
+        self.filter_wdgt.clear()
+        self.filter_wdgt.blockSignals(False)
+        self.filter_wdgt.setVisible(visible)
+        self.setFixedSize(300, 250 if visible else 220)
+
+    @staticmethod
+    def build_layer_automaton(needles):
+        """
+        Build Aho-Corasick automaton of layer name matches.
+
+        Only worthwhile for larger sets of matches, returns None otherwise or
+        if `pyahocorasick` is not installed.
+        """
+        if ahocorasick is None or len(needles) <= 8:
+            return None
+        automaton = ahocorasick.Automaton()
+        for needle in needles:
+            automaton.add_word(needle, needle)
+        automaton.make_automaton()
+        return automaton
+
     def filter_layer(self):
         """
-        Generate empty layer.
+        Return layer class.
 
-        This function generates empty layer which type depends on user entry.
+        This function returns the layer class which depends on user entry.
         """
-        type = self.layer_type.lower()
-        layer = {'vector': QgsVectorLayer(), 'raster': QgsRasterLayer()}
-        return layer[type]
+        return self.layer_classes[self.layer_type]
 
     def generate_feature_model(self):
         """Generate feature model based on applied filter."""
@@ -201,99 +349,109 @@ class LayerFieldFeatureWidget(QDialog):
         fields = layer.fields()
         field = self.accepted_field()
         field_index = fields.indexFromName(field.name())
+        # NULL values can neither be sorted nor formatted, they are left out.
+        unique_values = [value for value in layer.uniqueValues(field_index) if not self.is_null(value)]
 
         if field.isDateOrTime():
-            values = [value.toString(Qt.ISODate) for value in layer.uniqueValues(field_index)]
-            values.sort()
-            return values
+            return sorted(value.toString(Qt.ISODate) for value in unique_values)
         else:
-            values = [value for value in layer.uniqueValues(field_index)]
-            values.sort()
-            return [str(sorted_value) for sorted_value in values]
+            return list(map(str, sorted(unique_values)))
+
+    @staticmethod
+    def is_null(value):
+        """Check whether an attribute value is None or a NULL QVariant."""
+        return value is None or (isinstance(value, QVariant) and value.isNull())
 
     def generate_field_model(self, layer):
         """Generate field model based on applied filter."""
         temp_fields = QgsFields()
-        temp_features = QgsFeature()
 
-        if type(layer) != type(QgsRasterLayer()):
-            features_list = list(layer.getFeatures())
+        if not isinstance(layer, QgsRasterLayer):
             fields_list = layer.fields().toList()
-
-            if self.field_matches is not None:
-                for key in self.field_matches.keys():
-                    for field in fields_list:
-                        if key.lower() == field.name().lower():
-                            for feature in features_list:
-                                if field.type() == 2 or field.type() == 4:
-                                    temp_fields.append(QgsField(field.name(), QVariant.Int, field.typeName(), field.length(), field.precision()))
-                                    temp_features.setFields(temp_fields)
-                                    temp_features.setAttribute(temp_fields.indexFromName(field.name()), feature.attribute(field.name()))
-                                elif field.type() == 10:
-                                    temp_fields.append(QgsField(field.name(), QVariant.String, field.typeName(), field.length(), field.precision()))
-                                    temp_features.setFields(temp_fields)
-                                    temp_features.setAttribute(temp_fields.indexFromName(field.name()), feature.attribute(field.name()))
-                                elif field.type() == 14:
-                                    temp_fields.append(QgsField(field.name(), QVariant.Date, field.typeName(), field.length(), field.precision()))
-                                    temp_features.setFields(temp_fields)
-                                    temp_features.setAttribute(temp_fields.indexFromName(field.name()), feature.attribute(field.name()))
-                                elif field.type() == 6:
-                                    temp_fields.append(QgsField(field.name(), QVariant.Double, field.typeName(), field.length(), field.precision()))
-                                    temp_features.setFields(temp_fields)
-                                    temp_features.setAttribute(temp_fields.indexFromName(field.name()), feature.attribute(field.name()))
-            else:
-                for field in fields_list:
-                    for feature in features_list:
-                        if field.type() == 2 or field.type() == 4:
-                            temp_fields.append(QgsField(field.name(), QVariant.Int, field.typeName(), field.length(), field.precision()))
-                            temp_features.setFields(temp_fields)
-                            temp_features.setAttribute(temp_fields.indexFromName(field.name()), feature.attribute(field.name()))
-                        elif field.type() == 10:
-                            temp_fields.append(QgsField(field.name(), QVariant.String, field.typeName(), field.length(), field.precision()))
-                            temp_features.setFields(temp_fields)
-                            temp_features.setAttribute(temp_fields.indexFromName(field.name()), feature.attribute(field.name()))
-                        elif field.type() == 14:
-                            temp_fields.append(QgsField(field.name(), QVariant.Date, field.typeName(), field.length(), field.precision()))
-                            temp_features.setFields(temp_fields)
-                            temp_features.setAttribute(temp_fields.indexFromName(field.name()), feature.attribute(field.name()))
-                        elif field.type() == 6:
-                            temp_fields.append(QgsField(field.name(), QVariant.Double, field.typeName(), field.length(), field.precision()))
-                            temp_features.setFields(temp_fields)
-                            temp_features.setAttribute(temp_fields.indexFromName(field.name()), feature.attribute(field.name()))
+            field_matches = self.field_matches
+            variant_types = _QVAR_MAP
+
+            for field in fields_list:
+                if field_matches is not None and field.name().lower() not in field_matches:
+                    continue
+                variant_type = variant_types.get(field.type())
+                if variant_type is None:
+                    continue
+                temp_fields.append(QgsField(field.name(), variant_type, field.typeName(), field.length(), field.precision()))
             return temp_fields
         else:
-            return QgsFields()
+            return _EMPTY_FIELDS
+
+    @classmethod
+    def connect_model_cache(cls):
+        """Clear cached layer models once project layers are added, removed or renamed."""
+        if not cls._model_cache_connected:
+            project = QgsProject.instance()
+            project.layersAdded.connect(cls.watch_layers)
+            project.layersRemoved.connect(cls.clear_model_cache)
+            cls.watch_layers(project.mapLayers().values())
+            cls._model_cache_connected = True
+
+    @classmethod
+    def watch_layers(cls, layers):
+        """Clear cached layer models and do so again once any of the layers is renamed."""
+        for layer in layers:
+            layer.nameChanged.connect(cls.clear_model_cache)
+        cls.clear_model_cache()
+
+    @classmethod
+    def clear_model_cache(cls, *args):
+        """Drop all cached layer models."""
+        cls._model_cache.clear()
+
+    def model_cache_key(self):
+        """
+        Return the key of the layer model for the applied filter.
+
+        Project layers are not part of the key, as the cache is cleared whenever
+        they change, see `connect_model_cache`.
+        """
+        return (self.layer_type, self.geometry_type, self.layer_matches)
 
     def generate_layer_model(self):
         """Generate layer model based on applied filter."""
-        layers = set(self.get_project_layers())
-        type_layers = set()
-        geom_type_layers = set()
-        name_layers = set()
-
-        if len(self.layer_type) != 0:
-            type_layers = {layer for layer in layers if type(layer) == type(self.filter_layer())}
-
-        if self.geometry_type != 0:
-            geom_type_layers = {layer for layer in layers if type(layer) != type(QgsRasterLayer()) if layer.wkbType() == self.geometry_type}
+        if not self.layer_type and not self.layer_matches and not self.geometry_type:
+            return set()
 
-        if len(self.layer_matches) != 0:
-            for layer in layers:
-                for key in self.layer_matches.keys():
-                    if key.lower() in layer.name().lower():
-                        name_layers.add(layer)
+        key = self.model_cache_key()
+        if key not in self._model_cache:
+            self._model_cache[key] = frozenset(self.build_layer_model())
+        return set(self._model_cache[key])
 
-        if (len(self.layer_type) == len(self.layer_matches)) and (self.geometry_type == set()):
-            type_layers = layers
-            geom_type_layers = layers
-            name_layers = layers
-
-        allowed_layers = layers.intersection(type_layers | geom_type_layers | name_layers)
-        return layers.difference(allowed_layers)
+    def build_layer_model(self):
+        """Build layer model based on applied filter, bypassing the cache."""
+        # Attributes are bound to locals, as they are read once per layer.
+        layers = set(self.get_project_layers())
+        filter_class = self.filter_layer() if self.layer_type else None
+        vector_class = QgsVectorLayer
+        geometry_type = self.geometry_type
+        match_layer_name = self.match_layer_name if self.layer_matches else None
+        excepted_layers = set()
+
+        for layer in layers:
+            if filter_class is not None and isinstance(layer, filter_class):
+                continue
+            if geometry_type and isinstance(layer, vector_class) and layer.wkbType() == geometry_type:
+                continue
+            if match_layer_name is not None and match_layer_name(layer.name().lower()):
+                continue
+            excepted_layers.add(layer)
+        return excepted_layers
+
+    def match_layer_name(self, name):
+        """Check whether a lowercased layer name contains any of the layer matches."""
+        if self.layer_automaton is not None:
+            return next(self.layer_automaton.iter(name), None) is not None
+        return any(needle in name for needle in self.layer_needles)
 
     def get_project_layers(self):
         """Map QGIS-Project instances."""
-        return QgsProject.instance().mapLayers().values()
+        return list(QgsProject.instance().mapLayers().values())
 
     # Public functions listed below this line.
     def accepted_layer(self):
@@ -303,10 +461,11 @@ class LayerFieldFeatureWidget(QDialog):
     def accepted_field(self):
         """Return currently selected field."""
         fields = self.field_wdgt.fields()
-        try:
-            return fields.field(fields.indexFromName(self.field_wdgt.currentField()))
-        except:
+        name = self.field_wdgt.currentField()
+        if not name:
             return None
+        index = fields.indexFromName(name)
+        return fields.field(index) if index >= 0 else None
 
     def accepted_features(self):
         """Return currently selected/checked features."""